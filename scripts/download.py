@@ -1,11 +1,83 @@
 import os
+import re
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List
 from datetime import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Shared HTTP session factory: keep-alive connection pool with retries on transient errors
+
+def make_session(headers=None):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+# File names keep only the alphanumeric characters of the DOI
+
+_NONALNUM_RE = re.compile(r'[\W_]+')
+
+def sanitize_doi(doi):
+    return _NONALNUM_RE.sub('', doi)
+
+# Response bodies are streamed to disk in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+# Streams the body into a ".part" file and moves it onto file_path only once the
+# whole body has arrived, so a dropped connection never leaves a truncated file
+# (or clobbers a good copy from an earlier run)
+
+def save_response(response, file_path):
+    part_path = file_path + ".part"
+    try:
+        with open(part_path, "wb") as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+        os.replace(part_path, file_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+# Per-host token bucket: allows `max_calls` request starts per `period` seconds
+# (bursting up to `max_calls`) and caps in-flight requests, so each host is paced
+# independently while downloads overlap
+
+class RateLimiter:
+    def __init__(self, max_calls=1, period=1.0, max_in_flight=8):
+        self.max_calls = max_calls
+        self.rate = max_calls / period
+        self._tokens = float(max_calls)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_calls, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take a token now; a negative balance is a reservation to wait out
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
 
 # Elsevier Downloader Class
 
@@ -13,60 +85,52 @@ class ElsevierDownloader:
     def __init__(self, output_folder, api_key):
         self.output_folder = output_folder
         self.api_key = api_key
+        self.session = make_session()
+        self._limiter = RateLimiter(max_calls=1, period=1.0)
 
         # Create output folder if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
 
-    @staticmethod
-    def sanitize_doi(doi):
-        return ''.join(c for c in doi if c.isalnum())
-
     def download_paper(self, doi):
         try:
             api_key = self.api_key 
             url = f"https://api.elsevier.com/content/article/doi/{doi}?&apiKey={api_key}"
-            response = requests.get(url, timeout=100, stream=True)
-            response.raise_for_status()
+            with self._limiter:  # Avoid overwhelming the API
+                response = self.session.get(url, timeout=100, stream=True)
+                response.raise_for_status()
 
-            file_path = os.path.join(self.output_folder, f"{self.sanitize_doi(doi)}.html")
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(response.text)
+                file_path = os.path.join(self.output_folder, f"{sanitize_doi(doi)}.html")
+                save_response(response, file_path)
         except Exception as e:
             print(f"Error downloading DOI {doi}: {e}")
-        time.sleep(1.0)  # Avoid overwhelming the API
 
 # Springer Downloader Class
 
 class SpringerDownloader:
     def __init__(self, output_folder):
         self.output_folder = output_folder
+        self.session = make_session({
+            "Accept": "text/html",
+            "User-agent": "Mozilla/5.0"
+        })
+        self._limiter = RateLimiter(max_calls=1, period=1.0)
 
         # Create output folder if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
 
-    @staticmethod
-    def sanitize_doi(doi):
-        return ''.join(c for c in doi if c.isalnum())
-
     def download_paper(self, doi):
         try:
             url = f"http://link.springer.com/{doi}.html"
-            headers = {
-                "Accept": "text/html",
-                "User-agent": "Mozilla/5.0"
-            }
-            response = requests.get(url, headers=headers, timeout=100, stream=True)
-            response.raise_for_status()
+            with self._limiter:  # Avoid overwhelming the server
+                response = self.session.get(url, timeout=100, stream=True)
+                response.raise_for_status()
 
-            # Save the file
-            file_path = os.path.join(self.output_folder, f"{self.sanitize_doi(doi)}.html")
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(response.text)
+                # Save the file
+                file_path = os.path.join(self.output_folder, f"{sanitize_doi(doi)}.html")
+                save_response(response, file_path)
 
         except Exception as e:
             print(f"Error downloading DOI {doi}: {e}")
-        finally:
-            time.sleep(1.0)  # Avoid overwhelming the server
 
 # Wiley Downloader Class
 
@@ -74,33 +138,28 @@ class WileyDownloader:
     def __init__(self, output_folder, client_token):
         self.output_folder = output_folder
         self.client_token = client_token
+        self.session = make_session({"Wiley-TDM-Client-Token": self.client_token})
+        self._limiter = RateLimiter(max_calls=1, period=1.0)
 
         # Create output folder if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
 
-    @staticmethod
-    def sanitize_doi(doi):
-        return ''.join(c for c in doi if c.isalnum())
-
     def download_paper(self, doi):
         try:
             sanitized_doi = doi.replace("/", "%2F")
             url = f"https://api.wiley.com/onlinelibrary/tdm/v1/articles/{sanitized_doi}"
-            headers = {"Wiley-TDM-Client-Token": self.client_token}
             extension = ".pdf"
 
-            response = requests.get(url, headers=headers, timeout=100, stream=True)
-            response.raise_for_status()
+            with self._limiter:  # Avoid overwhelming the server
+                response = self.session.get(url, timeout=100, stream=True)
+                response.raise_for_status()
 
-            # Save the file
-            file_path = os.path.join(self.output_folder, f"{self.sanitize_doi(doi)}{extension}")
-            with open(file_path, "wb") as file:
-                file.write(response.content)
+                # Save the file
+                file_path = os.path.join(self.output_folder, f"{sanitize_doi(doi)}{extension}")
+                save_response(response, file_path)
 
         except Exception as e:
             print(f"Error downloading DOI {doi}: {e}")
-        finally:
-            time.sleep(1.0)  # Avoid overwhelming the server
 
 class DOIIntegrator:
     def __init__(self, output_folder: str, api_keys: dict):
@@ -149,56 +208,127 @@ class DOIIntegrator:
 
         return file_path
 
+# Buffered Mongo writes are flushed in batches of this size
+BATCH_SIZE = 500
+
+# Download threads; each host is still capped by its own RateLimiter
+MAX_WORKERS = 24
+
+# Scratch fields the download loop reads; the rest stays on the server
+DOWNLOAD_FIELDS = {'doi': 1, 'publisher': 1, 'safe_doi': 1}
+
+# Runs the buffered ops and clears the buffer; returns {op index: error message}
+# for ops that failed, so callers can handle those records one by one
+def flush_writes(collection, ops):
+    failed = {}
+    if ops:
+        try:
+            collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {err['index']: err.get('errmsg') for err in e.details.get('writeErrors', [])}
+        ops.clear()
+    return failed
+
 if __name__ == "__main__":
 
     client = MongoClient()
     scratch = client['scratch']['records']
     errors = client['scratch']['errors']
-    failed_records = list(scratch.find({'download_succeeded': False}))
+    scratch.create_index([('download_succeeded', 1), ('parsed', 1)])
+    scratch.create_index('doi', unique=True)
+    failed_records = list(scratch.find({'download_succeeded': False}, projection=DOWNLOAD_FIELDS))
     
     output_folder = '/data/scratch'
     api_keys = {"Elsevier": 'elsevier_key', "Wiley": "wiley_key"}
     integrator = DOIIntegrator(output_folder, api_keys)
-    
-    for record in tqdm(failed_records, total=len(failed_records)):
-        doi = record.get('doi')
-        safe_doi = record.get('safe_doi')
-        publisher = record.get('publisher')
-    
-        try:
-            file_path = integrator.download_from_record(record)
-    
-            # Set universal success flags
-            record['download_attempted'] = True
-            record['download_succeeded'] = True
-            record['download_date'] = datetime.utcnow()
-            record['have_any'] = True
-    
-            # Determine content type by extension
-            if file_path.endswith(".html"):
-                record['have_html'] = True
-                record['have_pdf'] = False
-                record['html_path'] = file_path
-                record['pdf_path'] = None
-            elif file_path.endswith(".pdf"):
-                record['have_pdf'] = True
-                record['have_html'] = False
-                record['pdf_path'] = file_path
-                record['html_path'] = None
-            else:
-                raise ValueError("Unknown file format downloaded.")
-    
-            # Update the scratch record using DOI as key
-            scratch.replace_one({'doi': record['doi']}, record)
-    
-        except Exception as e:
-             record['download_attempted'] = True
-             record['download_succeeded'] = False
-             record['download_error'] = str(e)
-             record['download_date'] = datetime.utcnow()
-             record.pop('_id', None)
-             errors.insert_one(record)
-             scratch.delete_one({'doi': record['doi']})
-             #print(f"[ERROR] Failed: {doi} — {e}")
+
+    scratch_buf, scratch_dois, errors_buf, errors_dois = [], [], [], []
+    failed = {}  # doi -> error fields for records moving to the errors collection
+
+    def flush_all():
+        # A record whose scratch update fails is moved to errors like a failed download
+        for index, errmsg in flush_writes(scratch, scratch_buf).items():
+            failed[scratch_dois[index]] = {
+                'download_attempted': True,
+                'download_succeeded': False,
+                'download_error': errmsg,
+                'download_date': datetime.utcnow()
+            }
+        scratch_dois.clear()
+        if not failed:
+            return
+
+        # Full records are read back only for the ones being moved to errors
+        for record in scratch.find({'doi': {'$in': list(failed)}}):
+            record.pop('_id', None)
+            record.update(failed[record['doi']])
+            errors_buf.append(InsertOne(record))
+            errors_dois.append(record['doi'])
+
+        # Error inserts go first so a failed record is never only deleted
+        unsaved = set()
+        for index, errmsg in flush_writes(errors, errors_buf).items():
+            unsaved.add(errors_dois[index])
+            print(f"Error saving record {errors_dois[index]}: {errmsg}")
+        errors_dois.clear()
+
+        scratch.delete_many({'doi': {'$in': [doi for doi in failed if doi not in unsaved]}})
+        failed.clear()
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        # Downloads run concurrently (paced per host by each downloader's limiter);
+        # records are finalized and Mongo writes queued on the main thread
+        futures = {executor.submit(integrator.download_from_record, record): record
+                   for record in failed_records}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            record = futures[future]
+        
+            try:
+                file_path = future.result()
+        
+                # Set universal success flags
+                record['download_attempted'] = True
+                record['download_succeeded'] = True
+                record['download_date'] = datetime.utcnow()
+                record['have_any'] = True
+        
+                # Determine content type by extension
+                if file_path.endswith(".html"):
+                    record['have_html'] = True
+                    record['have_pdf'] = False
+                    record['html_path'] = file_path
+                    record['pdf_path'] = None
+                elif file_path.endswith(".pdf"):
+                    record['have_pdf'] = True
+                    record['have_html'] = False
+                    record['pdf_path'] = file_path
+                    record['html_path'] = None
+                else:
+                    raise ValueError("Unknown file format downloaded.")
+        
+                # Update the scratch record using DOI as key
+                record.pop('_id', None)
+                scratch_buf.append(UpdateOne({'doi': record['doi']}, {'$set': record}, upsert=True))
+                scratch_dois.append(record['doi'])
         
-        time.sleep(1.0)
+            except Exception as e:
+                 failed[record['doi']] = {
+                     'download_attempted': True,
+                     'download_succeeded': False,
+                     'download_error': str(e),
+                     'download_date': datetime.utcnow()
+                 }
+                 #print(f"[ERROR] Failed: {doi} — {e}")
+
+            if len(scratch_buf) + len(failed) >= BATCH_SIZE:
+                flush_all()
+
+        executor.shutdown()
+    except BaseException:
+        # On Ctrl-C or a failed flush, drop the queued downloads instead of
+        # waiting for every remaining record to be fetched
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        flush_all()
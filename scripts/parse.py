@@ -1,41 +1,162 @@
 import re
-from bs4 import BeautifulSoup
+from collections import namedtuple
+from functools import lru_cache
+from html import unescape
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 import os
-import random
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 # ---------------------------------------
 # 1. DOI PREFIX MAPPING
 # ---------------------------------------
 PREFIXES = {
-    'els': ['10\.1016', '10\.1006', '10\.1205'],
-    'spr': ['10\.1007', '10\.1140', '10\.1891', '10\.1617', '10\.1023', '10\.1186'],
-    'rsc': ['10\.1039'],
+    'els': ['10.1016', '10.1006', '10.1205'],
+    'spr': ['10.1007', '10.1140', '10.1891', '10.1617', '10.1023', '10.1186'],
+    'rsc': ['10.1039'],
     # Add more here as needed
 }
 
+# Flattened registrant prefix -> publisher code for a single hashed lookup
+PREFIX2PUB = {prefix: publisher for publisher, prefixes in PREFIXES.items() for prefix in prefixes}
+
+_ABSTRACT_RE = re.compile('Abstract')
+
 def identify_publisher(doi):
-    for publisher, patterns in PREFIXES.items():
-        for pattern in patterns:
-            if re.match(pattern, doi):
-                return publisher
-    return None
+    return PREFIX2PUB.get(doi.split('/', 1)[0])
+
+# Section classification keywords, one precompiled alternation per rule
+def _keyword_re(keywords):
+    return re.compile('|'.join(re.escape(k) for k in keywords))
+
+_NULL_RE = _keyword_re([
+    'acknow', 'reference', 'author', 'highlight', 'supple', 'citing',
+    'appendix', 'fund', 'nomencl', 'support', 'times cited',
+    'publication history', 'keywords', 'key words', 'conflict'
+])
+_RESULTS_RE = _keyword_re(['result', 'discuss'])
+_METHODS_RE = _keyword_re(['experi', 'method'])
+_RECIPE_RE = _keyword_re(['material', 'reage', 'prep', 'treat', 'depo', 'processing', 'synth', 'fabrica'])
+_RECIPE_EXCLUDE_RE = _keyword_re(['charac', 'detect', 'analys', 'measurement', 'quanti', 'test'])
+_NONRECIPE_RE = _keyword_re([
+    'charac', 'test', 'analys', 'measurement', 'quanti', 'identi',
+    'scopy', 'spectro', 'x-ray', 'diffrac', 'quali', 'xr'
+])
+_NONRECIPE_EXCLUDE_RE = _keyword_re(['synth', 'prepar'])
+
+# Depends only on its arguments, and articles reuse a handful of headings
+@lru_cache(maxsize=4096)
+def _classify(section_name, supersection_name):
+    section = section_name.lower()
+    supersection = supersection_name.lower()
+    both = section + " " + supersection
+
+    # Rule 1: Null or irrelevant sections
+    if _NULL_RE.search(both):
+        return 'null'
+
+    # Rule 2: Abstract
+    if 'abstract' in section and 'abstract' in supersection:
+        return 'abstract'
+
+    # Rule 3: Intro
+    if 'intro' in section or 'intro' in supersection:
+        return 'intro'
+
+    # Rule 4: Results/Discussion
+    if _RESULTS_RE.search(both):
+        return 'results'
+
+    # Rule 5: Conclusion
+    if 'conclu' in both:
+        return 'conclusions'
+
+    # Rule 6: Recipe-related (synthesis, preparation)
+    if (_RECIPE_RE.search(section) and
+        _METHODS_RE.search(supersection) and
+        not _RECIPE_EXCLUDE_RE.search(both)):
+        return 'recipe'
+
+    # Rule 7: Non-recipe methods (characterization, analysis)
+    if (_NONRECIPE_RE.search(section) and
+        _METHODS_RE.search(supersection) and
+        not _NONRECIPE_EXCLUDE_RE.search(both)):
+        return 'nonrecipe_methods'
+
+    return 'other'
+
+# One parsed paragraph; converted to a dict only when written to Mongo
+Paragraph = namedtuple('Paragraph', 'section supersection text type')
+
+# <meta> tags in the first chunk of a file, for metadata reads without a soup.
+# Comments and raw-text elements are removed first: a "<meta" inside them is text
+# to an HTML parser. An element cut off by the chunk boundary is removed to the end.
+META_HEAD_BYTES = 64 * 1024
+_META_HIDDEN_RE = re.compile(
+    rb'<!--.*?(?:-->|\Z)|<(script|style|textarea|title)\b.*?(?:</\1\s*>|\Z)',
+    re.I | re.S)
+_META_TAG_RE = re.compile(rb'<meta\b[^>]*>', re.I)
+_ATTR_RE = re.compile(rb'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+def _stream_text(elem):
+    return ' '.join(''.join(elem.itertext()).split())
 
 # ---------------------------------------
 # 2. BASE CLASS
 # ---------------------------------------
 class PublisherParser:
+    __slots__ = ('file_path', 'soup', '_raw_bytes')
+
+    # Optional SoupStrainer restricting which subtrees BeautifulSoup builds
+    STRAINER = None
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.soup = None
+        self._raw_bytes = None
 
     def determine_parser(self):
         raise NotImplementedError
 
+    def load_bytes(self):
+        # The file is read once; sniffing, metadata and parsing share the buffer
+        with open(self.file_path, "rb") as file:
+            self._raw_bytes = file.read()
+
+    def read_head(self, size=2048):
+        # Start of the file for sniffing, without loading all of it if not loaded yet
+        if self._raw_bytes is not None:
+            return self._raw_bytes[:size]
+        with open(self.file_path, "rb") as file:
+            return file.read(size)
+
     def load_soup(self, parser):
-        with open(self.file_path, "r", encoding="utf-8", errors="ignore") as file:
-            self.soup = BeautifulSoup(file, parser)
+        try:
+            self.soup = BeautifulSoup(self._raw_bytes, parser, parse_only=self.STRAINER)
+        except Exception:
+            if parser != 'lxml':
+                raise
+            # Last resort for HTML libxml2 cannot handle: the pure-Python parser
+            self.soup = BeautifulSoup(self._raw_bytes, 'html.parser', parse_only=self.STRAINER)
+
+    def read_head_meta(self):
+        head = self.read_head(META_HEAD_BYTES)
+        # name -> content of the first <meta name=...> in the chunk ('' if it has no
+        # content); tags that are not valid UTF-8 are left to the soup
+        meta = {}
+        for tag in _META_TAG_RE.findall(_META_HIDDEN_RE.sub(b'', head)):
+            attrs = {k.lower(): v1 or v2 for k, v1, v2 in _ATTR_RE.findall(tag)}
+            try:
+                name = attrs.get(b'name', b'').decode('utf-8')
+                content = unescape(attrs.get(b'content', b'').decode('utf-8'))
+            except UnicodeDecodeError:
+                continue
+            if name:
+                meta.setdefault(name, content)
+        return meta
 
     def extract_metadata(self):
         raise NotImplementedError
@@ -44,52 +165,10 @@ class PublisherParser:
         raise NotImplementedError
 
     def classify_section(self, section_name, supersection_name=""):
-        section = section_name.lower() if section_name else ""
-        supersection = supersection_name.lower() if supersection_name else ""
-        both = section + " " + supersection
-    
-        # Rule 1: Null or irrelevant sections
-        if any(key in both for key in [
-            'acknow', 'reference', 'author', 'highlight', 'supple', 'citing',
-            'appendix', 'fund', 'nomencl', 'support', 'times cited',
-            'publication history', 'keywords', 'key words', 'conflict'
-        ]):
-            return 'null'
-    
-        # Rule 2: Abstract
-        if 'abstract' in section and 'abstract' in supersection:
-            return 'abstract'
-    
-        # Rule 3: Intro
-        if 'intro' in section or 'intro' in supersection:
-            return 'intro'
-    
-        # Rule 4: Results/Discussion
-        if any(k in both for k in ['result', 'discuss']):
-            return 'results'
-    
-        # Rule 5: Conclusion
-        if 'conclu' in both:
-            return 'conclusions'
-    
-        # Rule 6: Recipe-related (synthesis, preparation)
-        if (any(k in section for k in ['material', 'reage', 'prep', 'treat', 'depo', 'processing', 'synth', 'fabrica']) and
-            any(k in supersection for k in ['experi', 'method']) and
-            not any(k in both for k in ['charac', 'detect', 'analys', 'measurement', 'quanti', 'test'])):
-            return 'recipe'
-    
-        # Rule 7: Non-recipe methods (characterization, analysis)
-        if (any(k in section for k in [
-                'charac', 'test', 'analys', 'measurement', 'quanti', 'identi',
-                'scopy', 'spectro', 'x-ray', 'diffrac', 'quali', 'xr'
-            ]) and
-            any(k in supersection for k in ['experi', 'method']) and
-            not any(k in both for k in ['synth', 'prepar'])):
-            return 'nonrecipe_methods'
-    
-        return 'other'
+        return _classify(section_name or "", supersection_name or "")
 
     def parse(self):
+        self.load_bytes()
         parser = self.determine_parser()
         self.load_soup(parser)
         return {
@@ -97,14 +176,114 @@ class PublisherParser:
             "content": self.extract_content()
         }
 
+    def parse_metadata(self):
+        # Metadata only; publishers that can read it without a soup override this
+        self.load_bytes()
+        self.load_soup(self.determine_parser())
+        return self.extract_metadata()
+
 # ---------------------------------------
 # 3. ELSEVIER PARSER
 # ---------------------------------------
 class ElsevierParser(PublisherParser):
+    __slots__ = ()
+
+    # Elements the streaming XML path reacts to; everything else is skipped by lxml
+    STREAM_TAGS = ('{*}title', '{*}doi', '{*}abstract', '{*}section', '{*}section-title',
+                   '{*}para', '{*}table', '{*}figure', '{*}bibliography')
+    SKIP_TAGS = ('table', 'figure', 'bibliography')
+
     def determine_parser(self):
-        with open(self.file_path, "r", encoding="utf-8") as file:
-            content = file.read(2048).lower()
-        return 'xml' if '<?xml' in content or '<ce:title>' in content else 'lxml'
+        content = self.read_head().lower()
+        return 'xml' if b'<?xml' in content or b'<ce:title>' in content else 'lxml'
+
+    def parse(self):
+        # XML is streamed straight from the file; the full bytes are only read
+        # for HTML or when the XML is not well-formed. The file is sniffed once
+        # and the soup path reuses that answer.
+        parser = self.determine_parser()
+        if parser == 'xml':
+            try:
+                return self._parse_xml_stream()
+            except etree.XMLSyntaxError:
+                pass  # Not well-formed; fall back to the (recovering) soup path
+        self.load_bytes()
+        self.load_soup(parser)
+        return {
+            "metadata": self.extract_metadata(),
+            "content": self.extract_content()
+        }
+
+    def _parse_xml_stream(self):
+        metadata = {"title": None, "doi": None, "publisher": "Elsevier", "abstract": None}
+        paragraphs = []
+        classify = self.classify_section
+        append = paragraphs.append
+        sections = []  # titles of the enclosing <ce:section> elements, outermost first
+        current_section = 'Main'
+        in_abstract = 0
+        skip_depth = 0
+        para_depth = 0
+
+        for event, elem in etree.iterparse(self.file_path, events=('start', 'end'), tag=self.STREAM_TAGS):
+            name = etree.QName(elem).localname
+            if event == 'start':
+                if name == 'section':
+                    sections.append(current_section)
+                elif name == 'abstract':
+                    in_abstract += 1
+                elif name in self.SKIP_TAGS:
+                    skip_depth += 1
+                elif name == 'para':
+                    para_depth += 1
+                continue
+
+            if name == 'para':
+                para_depth -= 1
+
+            if name == 'abstract':
+                in_abstract -= 1
+                if not metadata['abstract']:
+                    paras = (_stream_text(p) for p in elem.iter('{*}simple-para', '{*}para'))
+                    metadata['abstract'] = ' '.join(p for p in paras if p) or None
+            elif name in self.SKIP_TAGS:
+                skip_depth -= 1
+            elif in_abstract or skip_depth:
+                continue  # Freed together with the enclosing abstract/table/figure
+            elif name == 'title':
+                if metadata['title'] is None:
+                    metadata['title'] = _stream_text(elem)
+            elif name == 'doi':
+                if metadata['doi'] is None:
+                    metadata['doi'] = _stream_text(elem)
+            elif name == 'section-title':
+                current_section = _stream_text(elem)
+                if sections:
+                    sections[-1] = current_section
+            elif name == 'section':
+                sections.pop()
+                if sections:
+                    current_section = sections[-1]
+            elif name == 'para':
+                text = _stream_text(elem)
+                if text:
+                    supersection = sections[-2] if len(sections) > 1 else current_section
+                    append(Paragraph(current_section, supersection, text, classify(current_section, supersection)))
+
+            # Inside an open para, elements are freed together with the para: clearing
+            # or pruning here would cut the para's text. A float only loses its own
+            # content, keeping the text that follows it.
+            if para_depth:
+                if name in self.SKIP_TAGS:
+                    elem.clear(keep_tail=True)
+                continue
+
+            # Free what has been consumed so memory stays flat on large documents
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        return {"metadata": metadata, "content": paragraphs}
 
     def extract_metadata(self):
         soup = self.soup
@@ -136,51 +315,77 @@ class ElsevierParser(PublisherParser):
     def extract_content(self):
         soup = self.soup
         paragraphs = []
+        classify = self.classify_section
+        append = paragraphs.append
         article_tag = soup.find("article") or soup.find("body")
         if not article_tag:
             return paragraphs
         for tag in article_tag.find_all(['table', 'figure', 'aside', 'footer', 'header', 'references', 'ref-list', 'nav', 'script', 'style']):
             tag.decompose()
-        current_section = 'Main'
+        # Open heading titles, outermost first: h1/h2/h3 are levels 1-3 and a
+        # section-title's level is its <ce:section> nesting depth. A paragraph's
+        # supersection is the heading one level above its section.
+        headings = ['Main']
+        current_section = supersection = 'Main'
         for tag in article_tag.find_all(['h1', 'h2', 'h3', 'ce:section-title', 'p', 'ce:para']):
-            if tag.name in ['h1', 'h2', 'h3', 'ce:section-title']:
+            # The xml builder strips the "ce:" prefix from tag.name, the HTML builders keep it
+            name = tag.name.rsplit(':', 1)[-1]
+            if name in ('h1', 'h2', 'h3', 'section-title'):
+                if name == 'section-title':
+                    level = max(1, sum(1 for parent in tag.parents if parent.name and parent.name.rsplit(':', 1)[-1] == 'section'))
+                else:
+                    level = int(name[1])
                 current_section = tag.get_text(strip=True)
-            elif tag.name in ['p', 'ce:para']:
+                headings = headings[:level - 1] + [current_section]
+                supersection = headings[-2] if len(headings) > 1 else current_section
+            elif name in ('p', 'para'):
                 text = tag.get_text(strip=True)
                 if text:
-                    paragraphs.append({
-                        "section": current_section,
-                        "supersection": supersection,
-                        "text": text,
-                        "type": self.classify_section(current_section, supersection)
-                    })
+                    append(Paragraph(current_section, supersection, text, classify(current_section, supersection)))
         return paragraphs
 
 # ---------------------------------------
 # 4. SPRINGER PARSER
 # ---------------------------------------
 class SpringerParser(PublisherParser):
+    __slots__ = ()
+
+    # Only the article body and <meta> tags are ever read
+    STRAINER = SoupStrainer(['article', 'body', 'meta', 'title'])
+
     def determine_parser(self):
-        with open(self.file_path, "r", encoding="utf-8") as file:
-            content = file.read(2048).lower()
-        return 'xml' if '<?xml' in content else 'lxml'
+        content = self.read_head().lower()
+        return 'xml' if b'<?xml' in content else 'lxml'
+
+    META_MAPPING = {
+        'title': ['citation_title', 'dc.title', 'og:title'],
+        'doi': ['citation_doi', 'prism.doi', 'dc.identifier'],
+        'abstract': ['dc.description', 'description', 'og:description', 'twitter:description']
+    }
+
+    def parse_metadata(self):
+        # Fast path: when the first-choice name= tag of every field sits in the head
+        # chunk, it is also the first match extract_metadata would find, so the result
+        # is the same without reading the rest of the file or building a soup
+        head_meta = self.read_head_meta()
+        if all(head_meta.get(names[0]) for names in self.META_MAPPING.values()):
+            metadata = {"title": None, "doi": None, "publisher": "Springer", "abstract": None}
+            for key, names in self.META_MAPPING.items():
+                metadata[key] = head_meta[names[0]].strip()
+            return metadata
+        return super().parse_metadata()
 
     def extract_metadata(self):
         soup = self.soup
         metadata = {"title": None, "doi": None, "publisher": "Springer", "abstract": None}
-        meta_mapping = {
-            'title': ['citation_title', 'dc.title', 'og:title'],
-            'doi': ['citation_doi', 'prism.doi', 'dc.identifier'],
-            'abstract': ['dc.description', 'description', 'og:description', 'twitter:description']
-        }
-        for key, names in meta_mapping.items():
+        for key, names in self.META_MAPPING.items():
             for name in names:
                 tag = soup.find('meta', attrs={"name": name}) or soup.find('meta', attrs={"property": name})
                 if tag and tag.get('content'):
                     metadata[key] = tag.get('content').strip()
                     break
         if not metadata["abstract"]:
-            section = soup.find(['section', 'div'], class_=re.compile('Abstract'))
+            section = soup.find(['section', 'div'], class_=_ABSTRACT_RE)
             if section:
                 para = section.find('p')
                 if para:
@@ -190,35 +395,34 @@ class SpringerParser(PublisherParser):
     def extract_content(self):
         soup = self.soup
         paragraphs = []
+        classify = self.classify_section
+        append = paragraphs.append
         article_tag = soup.find("article") or soup.find("body")
         if not article_tag:
             return paragraphs
         for tag in article_tag.find_all(['table', 'figure', 'aside', 'footer', 'header', 'nav', 'script', 'style']):
             tag.decompose()
         current_section = "Unknown"
-        for tag in article_tag.descendants:
+        for tag in article_tag.find_all(['h1', 'h2', 'h3', 'p']):
             if tag.name in ['h1', 'h2', 'h3']:
                 current_section = tag.get_text(strip=True)
             elif tag.name == 'p':
                 text = tag.get_text(strip=True)
                 if text:
-                    paragraphs.append({
-                        "section": current_section,
-                        "text": text,
-                        "type": self.classify_section(current_section)
-                    })
+                    append(Paragraph(current_section, None, text, classify(current_section)))
         return paragraphs
 
 # ---------------------------------------
 # 5. RSC PARSER
 # ---------------------------------------
 class RSCParser(PublisherParser):
+    __slots__ = ()
+
+    STRAINER = SoupStrainer(['article', 'body', 'meta', 'title'])
+
     def determine_parser(self):
-        with open(self.file_path, "r", encoding="utf-8", errors="ignore") as file:
-            content = file.read(2048).lower()
-        if "<?xml" in content or "xmlns" in content:
-            return "lxml"
-        return "html.parser"
+        # lxml's HTML mode handles both the XHTML and the tag-soup RSC pages
+        return "lxml"
 
     def extract_metadata(self):
         soup = self.soup
@@ -239,6 +443,8 @@ class RSCParser(PublisherParser):
     def extract_content(self):
         soup = self.soup
         paragraphs = []
+        classify = self.classify_section
+        append = paragraphs.append
         article_tag = soup.find('article') or soup.find('body')
         if not article_tag:
             return paragraphs
@@ -253,27 +459,60 @@ class RSCParser(PublisherParser):
             elif tag.name == 'p':
                 text = tag.get_text(" ", strip=True)
                 if text and len(text) > 20:
-                    paragraphs.append({
-                        "section": current_section,
-                        "text": text,
-                        "type": self.classify_section(current_section)
-                    })
+                    append(Paragraph(current_section, None, text, classify(current_section)))
         return paragraphs
 
 # ---------------------------------------
 # 6. MAIN INTERFACE
 # ---------------------------------------
-def parse_document(doi, file_path):
+def get_parser(doi, file_path):
     publisher_code = identify_publisher(doi)
     if publisher_code == 'els':
-        parser = ElsevierParser(file_path)
+        return ElsevierParser(file_path)
     elif publisher_code == 'spr':
-        parser = SpringerParser(file_path)
+        return SpringerParser(file_path)
     elif publisher_code == 'rsc':
-        parser = RSCParser(file_path)
-    else:
-        raise ValueError(f"Unsupported publisher for DOI: {doi}")
-    return parser.parse()
+        return RSCParser(file_path)
+    raise ValueError(f"Unsupported publisher for DOI: {doi}")
+
+def parse_document(doi, file_path):
+    return get_parser(doi, file_path).parse()
+
+# Title/DOI/abstract without the paragraphs; cheaper where the publisher allows it
+def parse_document_metadata(doi, file_path):
+    return get_parser(doi, file_path).parse_metadata()
+
+# Runs in a worker process: returns (record, parsed_data, error) and never
+# touches Mongo. Both are None when the downloaded file is missing.
+def parse_one(record):
+    doi = record.get('doi')
+    file_path = record.get('html_path')
+
+    if not file_path or not os.path.exists(file_path):
+        return record, None, None
+
+    try:
+        return record, parse_document(doi, file_path), None
+    except Exception as e:
+        return record, None, str(e)
+
+# Buffered Mongo writes are flushed in batches of this size
+BATCH_SIZE = 500
+
+# Scratch fields the parse loop reads; full records are fetched only when moved
+PARSE_FIELDS = {'doi': 1, 'html_path': 1, 'title': 1, 'safe_doi': 1}
+
+# Runs the buffered ops and clears the buffer; returns {op index: error message}
+# for ops that failed, so callers can handle those records one by one
+def flush_writes(collection, ops):
+    failed = {}
+    if ops:
+        try:
+            collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {err['index']: err.get('errmsg') for err in e.details.get('writeErrors', [])}
+        ops.clear()
+    return failed
 
 if __name__ == "__main__":
     
@@ -282,42 +521,84 @@ if __name__ == "__main__":
     papers = client['papers']['records']
     metadata = client['metadata']['records']
     scratch_errors = client['scratch']['errors']
+    scratch.create_index([('download_succeeded', 1), ('parsed', 1)])
     # Step 1: Find all records ready to be parsed
-    records = list(scratch.find({'download_succeeded': True, 'parsed': False}))
+    records = list(scratch.find({'download_succeeded': True, 'parsed': False}, projection=PARSE_FIELDS))
     print(f"Found {len(records)} unparsed records.")
 
-    for record in tqdm(records, total=len(records)):
-        doi = record.get('doi')
-        file_path = record.get('html_path')
-    
-        if not file_path or not os.path.exists(file_path):
-            continue
-    
-        try:
-            # Step 1: Run the parser
-            parsed_data = parse_document(doi, file_path)
-    
-            # Step 2: Save parsed content to 'papers.records'
-            _dict = {
-                'doi': doi,
-                'title': record.get('title'),
-                'safe_doi': record.get('safe_doi'),
-                'paragraphs': parsed_data['content']
-            }
-            papers.insert_one(_dict)
-    
-            # Step 3: Move record to 'metadata.records' with updated flags
-            record['parsed'] = True
-            record['parsed_date'] = datetime.utcnow()
-            metadata.insert_one(record)
-    
-        except Exception as e:
+    papers_buf, papers_ids = [], []
+    outcomes = {}  # scratch _id -> fields to set when the record leaves scratch
+
+    def flush_all():
+        # A record whose paper write fails is sent to errors instead of metadata
+        for index, errmsg in flush_writes(papers, papers_buf).items():
+            outcomes[papers_ids[index]] = {'parsed': False, 'error': errmsg}
+        papers_ids.clear()
+        if not outcomes:
+            return
+
+        # Step 3: Move full records to 'metadata.records' (or errors) with updated
+        # flags; they are only read back here, one query per batch
+        metadata_buf, metadata_records, errors_buf, errors_records = [], [], [], []
+        for record in scratch.find({'_id': {'$in': list(outcomes)}}):
+            fields = outcomes[record['_id']]
+            record.update(fields)
+            if fields['parsed']:
+                metadata_buf.append(InsertOne(record))
+                metadata_records.append(record)
+            else:
+                errors_buf.append(InsertOne(record))
+                errors_records.append(record)
+
+        for index, errmsg in flush_writes(metadata, metadata_buf).items():
+            record = metadata_records[index]
+            record.pop('parsed_date', None)
             record['parsed'] = False
-            record['error'] = str(e)
-            scratch_errors.insert_one(record)
-    
-        finally:
-            # Step 4: Always delete original from 'scratch.records'
-            scratch.delete_one({'_id': record['_id']})
-    
-    
\ No newline at end of file
+            record['error'] = errmsg
+            errors_buf.append(InsertOne(record))
+            errors_records.append(record)
+
+        unsaved = set()
+        for index, errmsg in flush_writes(scratch_errors, errors_buf).items():
+            record = errors_records[index]
+            unsaved.add(record['_id'])
+            print(f"Error saving record {record.get('doi')}: {errmsg}")
+
+        # Step 4: Delete every record that was stored in metadata or errors; one
+        # that could not be stored anywhere stays in scratch for the next run
+        scratch.delete_many({'_id': {'$in': [_id for _id in outcomes if _id not in unsaved]}})
+        outcomes.clear()
+
+    executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    try:
+        # Parsing fans out to worker processes; all Mongo writes happen here
+        results = executor.map(parse_one, records, chunksize=32)
+        for record, parsed_data, error in tqdm(results, total=len(records)):
+            if parsed_data is None and error is None:
+                continue
+
+            if error is None:
+                # Step 2: Save parsed content to 'papers.records'
+                # Upserted by DOI so a rerun after an interrupted batch does not duplicate it
+                papers_buf.append(UpdateOne({'doi': record.get('doi')}, {'$set': {
+                    'doi': record.get('doi'),
+                    'title': record.get('title'),
+                    'safe_doi': record.get('safe_doi'),
+                    'paragraphs': [p._asdict() for p in parsed_data['content']]
+                }}, upsert=True))
+                papers_ids.append(record['_id'])
+                outcomes[record['_id']] = {'parsed': True, 'parsed_date': datetime.utcnow()}
+            else:
+                outcomes[record['_id']] = {'parsed': False, 'error': error}
+
+            if len(outcomes) >= BATCH_SIZE:
+                flush_all()
+
+        executor.shutdown()
+    except BaseException:
+        # On Ctrl-C or a failed flush, drop the queued chunks instead of
+        # parsing the rest of the collection first
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        flush_all()
@@ -1,30 +1,48 @@
 import os
+import re
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
 import dimcli
 
+# Concurrent Crossref lookups and scratch insert batch size used by DoiAggregator
+CROSSREF_WORKERS = 16
+INSERT_BATCH_SIZE = 500
+
 # ---------------------------
 # Helper: Crossref metadata fetcher
 # ---------------------------
 
+# One keep-alive session reused for every Crossref lookup
+_CROSSREF_SESSION = requests.Session()
+_CROSSREF_SESSION.headers.update({"User-Agent": "pipeline_new"})
+_CROSSREF_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504))
+))
+
+_NONALNUM_RE = re.compile(r'[\W_]+')
+
+def sanitize_doi(doi):
+    return _NONALNUM_RE.sub('', doi)
+
 def get_crossref_metadata(doi):
     url = f"https://api.crossref.org/works/{doi}"
-    response = requests.get(url)
+    response = _CROSSREF_SESSION.get(url)
     
     if response.status_code != 200:
         return None
 
     metadata = response.json()['message']
 
-    def sanitize_doi(doi):
-        return ''.join(c for c in doi if c.isalnum())
-    
     def get_first(lst):
         return lst[0] if lst and len(lst) > 0 else None
 
@@ -67,6 +85,15 @@ def get_crossref_metadata(doi):
         'priority': 1
     }
 
+# Thread-pool worker: one failed lookup is logged and skipped instead of
+# aborting the whole aggregation
+def fetch_crossref_metadata(doi):
+    try:
+        return doi, get_crossref_metadata(doi)
+    except Exception as e:
+        print(f"Error fetching Crossref metadata for DOI {doi}: {e}")
+        return doi, None
+
 # ---------------------------
 # Extractors
 # ---------------------------
@@ -102,6 +129,7 @@ class LensExtractor:
     def __init__(self):
         self.token = "token"
         self.url = "https://api.lens.org/scholarly/search"
+        self.session = requests.Session()
 
     def extract(self, keyword, size=100):
         headers = {
@@ -116,7 +144,7 @@ class LensExtractor:
             "scroll": "1m"
         }
 
-        response = requests.post(self.url, json=request_body, headers=headers)
+        response = self.session.post(self.url, json=request_body, headers=headers)
 
         if response.status_code != 200:
             print(f"Lens API Error: {response.status_code}")
@@ -128,7 +156,7 @@ class LensExtractor:
 
         while scroll_id and len(all_records) < size:
             scroll_request_body = {"scroll_id": scroll_id}
-            response = requests.post(self.url, json=scroll_request_body, headers=headers)
+            response = self.session.post(self.url, json=scroll_request_body, headers=headers)
 
             if response.status_code == 429:
                 retry_after = int(response.headers.get('x-rate-limit-retry-after-seconds', 8))
@@ -159,7 +187,7 @@ class CrossrefExtractor:
             "title": {"$elemMatch": {"$regex": keyword, "$options": "i"}}
         }
 
-        cursor = self.collection.find(query, no_cursor_timeout=True).limit(size)
+        cursor = self.collection.find(query, {'DOI': 1}, no_cursor_timeout=True).limit(size)
 
         doi_list = []
         for doc in cursor:
@@ -184,6 +212,26 @@ class DoiAggregator:
         self.client = MongoClient('mongodb://localhost:27017')
         self.metadata_coll = self.client['metadata']['records']
         self.scratch_coll = self.client['scratch']['records']
+        self.scratch_coll.create_index('doi', unique=True)
+        self.metadata_coll.create_index([('doi', 1), ('download', 1)])
+
+    def _insert_batch(self, batch):
+        # Returns (inserted DOIs, duplicate count); duplicates are expected and skipped
+        failed = {}
+        try:
+            self.scratch_coll.insert_many([meta for _, meta in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {err['index']: err for err in e.details.get('writeErrors', [])}
+
+        duplicates = 0
+        for index, err in failed.items():
+            if err.get('code') == 11000:
+                duplicates += 1
+            else:
+                print(f"Error inserting DOI {batch[index][0]}: {err.get('errmsg')}")
+
+        inserted = [doi for index, (doi, _) in enumerate(batch) if index not in failed]
+        return inserted, duplicates
 
     def aggregate_dois(self, keywords: List[str], size_per_source=500) -> List[str]:
         dims_dois = []
@@ -198,23 +246,30 @@ class DoiAggregator:
 
         all_dois = set(dims_dois).union(set(lens_dois)).union(set(crossref_dois))
 
+        # One round trip for every DOI that has already been downloaded
+        downloaded = set(self.metadata_coll.distinct('doi', {'doi': {'$in': list(all_dois)}, 'download': True}))
+        new_dois = all_dois - downloaded
+
         final_dois = []
         duplicate_count = 0
-
-        for doi in tqdm(all_dois, desc="Checking and inserting DOIs"):
-            exists = self.metadata_coll.find_one({'doi': doi, 'download': True})
-            if exists:
-                continue
-
-            crossref_meta = get_crossref_metadata(doi)
-            if crossref_meta:
-                try:
-                    self.scratch_coll.insert_one(crossref_meta)
-                    final_dois.append(doi)
-                except DuplicateKeyError:
-                    duplicate_count += 1
-                except Exception as e:
-                    print(f"Error inserting DOI {doi}: {e}")
+        batch = []
+
+        # Crossref lookups run concurrently; inserts are batched on this thread
+        with ThreadPoolExecutor(max_workers=CROSSREF_WORKERS) as executor:
+            results = executor.map(fetch_crossref_metadata, new_dois)
+            for doi, crossref_meta in tqdm(results, total=len(new_dois), desc="Checking and inserting DOIs"):
+                if crossref_meta:
+                    batch.append((doi, crossref_meta))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    inserted, duplicates = self._insert_batch(batch)
+                    final_dois.extend(inserted)
+                    duplicate_count += duplicates
+                    batch = []
+
+        if batch:
+            inserted, duplicates = self._insert_batch(batch)
+            final_dois.extend(inserted)
+            duplicate_count += duplicates
 
         print(f"Completed aggregation. {duplicate_count} duplicate DOIs were skipped.")
         
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from parse import ElsevierParser, SpringerParser, parse_document, parse_document_metadata
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_elsevier_stream_keeps_para_text_around_floats():
+    file_path = os.path.join(FIXTURES, 'elsevier_float_in_para.xml')
+    parsed = parse_document('10.1016/j.test.2020.01.001', file_path)
+
+    assert parsed['metadata']['doi'] == '10.1016/j.test.2020.01.001'
+    assert [p.text for p in parsed['content']] == [
+        'First para text tail after figure.',
+        'Second para tail after table.',
+    ]
+    assert all(p.section == 'Introduction' for p in parsed['content'])
+
+
+def test_elsevier_stream_matches_soup_paragraph_count():
+    file_path = os.path.join(FIXTURES, 'elsevier_float_in_para.xml')
+    soup_parser = ElsevierParser(file_path)
+    soup_parser.load_bytes()
+    soup_parser.load_soup('xml')
+
+    streamed = parse_document('10.1016/j.test.2020.01.001', file_path)['content']
+    assert len(streamed) == len(soup_parser.extract_content())
+
+
+def test_springer_metadata_only_skips_soup():
+    file_path = os.path.join(FIXTURES, 'springer_meta.html')
+    parser = SpringerParser(file_path)
+    metadata = parser.parse_metadata()
+
+    assert parser.soup is None
+    assert metadata == parse_document('10.1007/abc', file_path)['metadata']
+    assert metadata['title'] == 'Real & Title'
+    assert metadata['abstract'] == 'The abstract.'
+
+
+def test_springer_metadata_only_falls_back_to_soup(tmp_path):
+    file_path = tmp_path / 'no_abstract.html'
+    file_path.write_text(
+        '<html><head><meta name="citation_title" content="T">'
+        '<meta name="citation_doi" content="10.1007/x"></head>'
+        '<body><article><section class="Abstract"><p>From the body.</p></section>'
+        '</article></body></html>')
+
+    assert parse_document_metadata('10.1007/x', str(file_path))['abstract'] == 'From the body.'